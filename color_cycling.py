@@ -3,28 +3,127 @@ import os
 import sys
 import re
 import math
+import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
+HEX_COLOR_RE = re.compile(r'^#?([a-fA-F0-9]{6})$')
+
 # --- Helper Functions ---
 
 def hex_to_rgb(hex_color):
     """Converts a hex color string (#RRGGBB or RRGGBB) to an RGB tuple."""
-    hex_color = hex_color.lstrip('#')
-    if len(hex_color) != 6:
+    match = HEX_COLOR_RE.match(hex_color.strip())
+    if not match:
         raise ValueError(f"Invalid hex color format: '{hex_color}'")
-    try:
-        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-    except ValueError:
-        raise ValueError(f"Invalid characters in hex color: '{hex_color}'")
+    return tuple(bytes.fromhex(match.group(1)))
 
 def validate_hex_color(color_str):
     """Checks if a string is a valid hex color format."""
-    return re.match(r'^#?([a-fA-F0-9]{6})$', color_str.strip())
-
-def calculate_lcm(a, b):
-    """Calculates the Least Common Multiple (LCM) of two integers."""
-    return abs(a * b) // math.gcd(a, b) if a != 0 and b != 0 else 0
+    return HEX_COLOR_RE.match(color_str.strip())
+
+def pack_planes(r, g, b):
+    """Packs separate R, G and B uint8 planes into a uint32 array of 0xRRGGBB keys."""
+    return (r.astype(np.uint32) << 16) | (g.astype(np.uint32) << 8) | b
+
+def pack_rgb(pixels):
+    """Packs an (N, 3) uint8 RGB array into an (N,) uint32 array of 0xRRGGBB keys."""
+    return pack_planes(pixels[:, 0], pixels[:, 1], pixels[:, 2])
+
+def unpack_rgb(keys):
+    """Unpacks an (N,) uint32 array of 0xRRGGBB keys into an (N, 3) uint8 RGB array."""
+    return np.stack([(keys >> 16) & 0xFF, (keys >> 8) & 0xFF, keys & 0xFF], axis=1).astype(np.uint8)
+
+def palettize(keys, cycled_keys):
+    """Converts (N,) packed RGB pixel keys into palette indices for color cycling.
+
+    Every cycled color present in the image gets its own palette slot, so it can be
+    recolored by editing the palette alone. The remaining (static) colors fill the
+    slots that are left, and are quantized if there are too many of them.
+
+    cycled_keys must be sorted. Returns a (uint8 indices, (M, 3) uint8 palette,
+    {cycled key: slot}) tuple.
+    """
+    # Split the pixels once into cycled and static ones; each group is handled on its own.
+    # A binary search over the sorted cycled keys finds each pixel's color in one pass.
+    match = np.searchsorted(cycled_keys, keys).clip(0, len(cycled_keys) - 1)
+    is_target = cycled_keys[match] == keys
+    # Resolve the mask to index arrays once; every later write only touches its own pixels
+    target_idx = np.flatnonzero(is_target)
+    static_idx = np.flatnonzero(~is_target)
+    target_match = match[target_idx]
+
+    # Only cycled colors that actually appear in the image need a slot
+    present = np.zeros(len(cycled_keys), dtype=bool)
+    present[target_match] = True
+    reserved = cycled_keys[present]
+    if len(reserved) > 255:
+        raise ValueError("Too many cycled colors in the image to fit in a 256 color palette.")
+    free = 256 - len(reserved)
+
+    static_keys, static_indices = np.unique(keys[static_idx], return_inverse=True)
+    if len(static_keys) <= free:
+        static_palette = unpack_rgb(static_keys)
+    else:
+        # Quantizing already loses detail, so leave one slot spare for frame transparency
+        free = max(free - 1, 1)
+        quantized = Image.fromarray(unpack_rgb(keys[static_idx]).reshape(1, -1, 3), 'RGB').quantize(colors=free)
+        static_indices = np.asarray(quantized).ravel()
+        static_palette = np.array(quantized.getpalette(), dtype=np.uint8).reshape(-1, 3)[:free]
+
+    offset = len(static_palette)
+    indices = np.empty(len(keys), dtype=np.uint8)
+    indices[static_idx] = static_indices
+    indices[target_idx] = offset + (np.cumsum(present) - 1)[target_match]
+
+    palette = np.concatenate([static_palette, unpack_rgb(reserved)])
+    slots = {int(k): offset + i for i, k in enumerate(reserved)}
+    return indices, palette, slots
+
+def build_frame_palettes(base_palette, cycle_slots, num_frames):
+    """Precomputes the palette of every frame as a (num_frames, M, 3) uint8 array.
+
+    cycle_slots holds one (slots, list_rgb, positions) tuple per color list: the palette
+    slots a list owns, the list's RGB colors and each slot's position in the list.
+    """
+    palettes = np.repeat(base_palette[np.newaxis], num_frames, axis=0)
+    for slots, list_rgb, positions in cycle_slots:
+        # A list only has len(list_rgb) distinct rotations; build each once with np.roll
+        # and let every frame pick the rotation it needs
+        list_len = len(list_rgb)
+        rotations = np.stack([np.roll(list_rgb, -k, axis=0)[positions] for k in range(list_len)])
+        palettes[:, slots] = rotations[np.arange(num_frames) % list_len]
+    return palettes
+
+def iter_frames(indices, size, palettes):
+    """Yields one 'P' mode frame per palette.
+
+    The first frame is complete. Each later frame only keeps the pixels whose color
+    changed since the previous frame; the rest point at an extra transparent palette
+    slot, so viewers keep showing the previous frame there and the LZW encoder sees
+    long runs of a single index. If the palette is already full, every frame is
+    written complete.
+    """
+    index_image = Image.frombuffer('L', size, indices, 'raw', 'L', 0, 1)
+    previous = None
+    for palette in palettes:
+        transparent = len(palette) if len(palette) < 256 else None
+        if previous is None or transparent is None:
+            frame_image = Image.frombuffer('P', size, indices, 'raw', 'P', 0, 1)
+        else:
+            # Map changed slots to themselves and all others to the transparent slot,
+            # and let Pillow apply that 256-entry table to the indices
+            changed_slots = (palette != previous).any(axis=1)
+            slot_map = np.where(changed_slots, np.arange(transparent), transparent)
+            frame_image = index_image.point(slot_map.tolist() + [transparent] * (256 - transparent))
+            frame_image.info['transparency'] = transparent
+        previous = palette
+
+        palette_bytes = palette.tobytes()
+        if transparent is not None:
+            palette_bytes += bytes(3) # Color of the transparent slot, never shown
+        frame_image.putpalette(palette_bytes)
+        yield frame_image
 
 def get_color_lists_from_user():
     """Prompts the user to enter one or more lists of hex colors."""
@@ -100,6 +199,7 @@ def main():
     color_lists_rgb = []
     all_target_colors_rgb = set()
     color_list_map = {} # Maps an original RGB color to the index of its list
+    owned_colors = [] # Per list: (position, color) of the colors that cycle with that list
 
     print("\n--- Target Color Groups ---")
     try:
@@ -107,7 +207,8 @@ def main():
             rgb_list = [hex_to_rgb(c) for c in hex_list]
             print(f"Group {i+1}: {[f'#{r:02x}{g:02x}{b:02x}' for r, g, b in rgb_list]}")
             color_lists_rgb.append(rgb_list)
-            for color_rgb in rgb_list:
+            owned_colors.append([])
+            for position, color_rgb in enumerate(rgb_list):
                 if color_rgb in all_target_colors_rgb:
                     print(f"Warning: Color {f'#{color_rgb[0]:02x}{color_rgb[1]:02x}{color_rgb[2]:02x}'} "
                           f"appears in multiple lists. It will cycle according to the *first* list it appeared in.", file=sys.stderr)
@@ -115,6 +216,8 @@ def main():
                      # Only add to map if not already present from another list
                      color_list_map[color_rgb] = i
                 all_target_colors_rgb.add(color_rgb)
+                if color_list_map[color_rgb] == i:
+                    owned_colors[i].append((position, color_rgb))
     except ValueError as e:
         print(f"Error processing hex colors: {e}", file=sys.stderr)
         sys.exit(1)
@@ -136,56 +239,41 @@ def main():
         sys.exit(1)
 
     width, height = base_image.size
-    base_pixels = list(base_image.getdata()) # Get pixel data as a list
+    # Pack each pixel into a single 0xRRGGBB key so colors can be matched with NumPy.
+    # Pillow splits the image into contiguous R, G and B planes, so packing reads each
+    # channel with unit stride instead of striding through interleaved RGB triples.
+    base_keys = pack_planes(*(np.asarray(band).ravel() for band in base_image.split()))
 
     # 5. Calculate total number of frames (LCM of list lengths)
-    num_frames = 1
-    if color_lists_rgb:
-        num_frames = len(color_lists_rgb[0])
-        for i in range(1, len(color_lists_rgb)):
-            num_frames = calculate_lcm(num_frames, len(color_lists_rgb[i]))
+    num_frames = math.lcm(*(len(color_list) for color_list in color_lists_rgb)) if color_lists_rgb else 1
 
     print(f"Generating {num_frames} frames...")
 
-    # 6. Generate frames
-    frames = []
+    # Convert to palette indices once; each frame then only rewrites the palette
+    cycled_keys = pack_rgb(np.array(sorted(color_list_map), dtype=np.uint8)) # Sorted RGB tuples pack to sorted keys
     try:
-        for frame_index in tqdm(range(num_frames), desc="Generating Frames", unit="frame"):
-            new_pixel_data = list(base_pixels) # Start with a copy of original data
-
-            # Determine color mapping for this frame
-            # A dictionary mapping original_color -> new_color for this frame
-            current_frame_map = {}
-            for list_index, color_list in enumerate(color_lists_rgb):
-                list_len = len(color_list)
-                for i, original_color in enumerate(color_list):
-                    # Only map colors belonging to *this* list based on our initial mapping
-                    if color_list_map.get(original_color) == list_index:
-                        new_color_index = (i + frame_index) % list_len
-                        current_frame_map[original_color] = color_list[new_color_index]
-
-
-            # Apply color mapping to pixels
-            for i in range(len(new_pixel_data)):
-                original_pixel = new_pixel_data[i]
-                # Check if this pixel's color is one of the *originally* targeted colors
-                if original_pixel in current_frame_map:
-                     new_pixel_data[i] = current_frame_map[original_pixel]
-
-
-            # Create the frame image
-            frame_image = Image.new('RGB', (width, height))
-            frame_image.putdata(new_pixel_data)
-            frames.append(frame_image)
-
-    except MemoryError:
-         print("\nError: Ran out of memory while generating frames.", file=sys.stderr)
-         print("Try with a smaller image or fewer frames/colors.", file=sys.stderr)
-         sys.exit(1)
-    except Exception as e:
-         print(f"\nError during frame generation: {e}", file=sys.stderr)
-         sys.exit(1)
+        indices, base_palette, slots = palettize(base_keys, cycled_keys)
+    except ValueError as e:
+        print(f"Error building palette: {e}", file=sys.stderr)
+        sys.exit(1)
 
+    # For each list: the palette slots of the colors it owns, and their positions in the list
+    cycle_slots = []
+    for color_list, owned in zip(color_lists_rgb, owned_colors):
+        if not owned:
+            continue # Every color of this list cycles with an earlier list
+        positions, colors = zip(*owned)
+        owned_keys = pack_rgb(np.array(colors, dtype=np.uint8)).tolist()
+        present = [(slots[key], i) for i, key in zip(positions, owned_keys) if key in slots]
+        if present:
+            owned_slots, present_positions = (np.array(x, dtype=np.intp) for x in zip(*present))
+            cycle_slots.append((owned_slots, np.array(color_list, dtype=np.uint8), present_positions))
+    palettes = build_frame_palettes(base_palette, cycle_slots, num_frames)
+
+    # 6. Generate frames lazily: each one is created as the GIF writer asks for it,
+    # instead of keeping every frame alive in a list
+    frames = iter_frames(indices, (width, height),
+                         tqdm(palettes, desc="Generating Frames", unit="frame"))
 
     # 7. Save as GIF
     output_filename = args.output
@@ -195,15 +283,22 @@ def main():
 
     try:
         print(f"\nSaving GIF to {output_filename}...")
-        frames[0].save(
+        next(frames).save(
             output_filename,
             save_all=True,
-            append_images=frames[1:], # Append frames 1 to end
+            append_images=frames,     # Remaining frames, generated while saving
             duration=args.duration,   # ms per frame
             loop=args.loop,           # 0 = loop forever
+            disposal=1,               # Leave each frame in place; unchanged areas are not rewritten
             optimize=False            # Optimization can sometimes affect colors/quality
+            # No shared palette is passed: frames are already 'P' mode, so each one is
+            # written as-is with its own local color table and no quantization or remapping.
         )
         print("GIF saved successfully!")
+    except MemoryError:
+        print("\nError: Ran out of memory while generating frames.", file=sys.stderr)
+        print("Try with a smaller image or fewer frames/colors.", file=sys.stderr)
+        sys.exit(1)
     except Exception as e:
         print(f"Error saving GIF: {e}", file=sys.stderr)
         sys.exit(1)